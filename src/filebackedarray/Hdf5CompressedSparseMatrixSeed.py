@@ -1,8 +1,11 @@
-from typing import Optional, Sequence, Tuple, Callable
+from typing import Optional, Sequence, Tuple, Callable, List, Union
 from delayedarray import extract_dense_array, extract_sparse_array, chunk_shape, DelayedArray, wrap, is_sparse, SparseNdarray
 from h5py import File
-from numpy import ndarray, dtype, integer, zeros, issubdtype, array
-from bisect import bisect_left
+from weakref import finalize
+from numpy import ndarray, dtype, integer, zeros, issubdtype, diff, flatnonzero, full, arange, cumsum, intp, repeat, concatenate, argsort, bincount, promote_types, min_scalar_type, searchsorted, split, empty
+
+from ._utils import _open_file, _release_file, _release_file_now, _open_dataset, _check_chunk_size, _default_cache_size, _range_reader, _sanitize_subset, _subset_to_array, _is_contiguous_range
+from ._sparse_kernels import _subset_run
 
 __author__ = "LTLA"
 __copyright__ = "LTLA"
@@ -27,6 +30,11 @@ class Hdf5CompressedSparseMatrixSeed:
         data_name: Optional[str] = None,
         indices_name: Optional[str] = None,
         indptr_name: Optional[str] = None,
+        rdcc_nbytes: Optional[int] = None,
+        rdcc_nslots: Optional[int] = None,
+        transposed_group_name: Optional[str] = None,
+        chunk_shape: Optional[Tuple[int, int]] = None,
+        check_chunks: bool = True,
     ):
         """
         Args:
@@ -64,6 +72,40 @@ class Hdf5CompressedSparseMatrixSeed:
             indptr_name:
                 Name of the dataset containing the pointers. Defaults to
                 ``group_name`` plus ``/indptr``.
+
+            rdcc_nbytes:
+                Size of the HDF5 chunk cache in bytes, used when reading
+                from the file. Defaults to 4 times the size of the largest
+                chunk in the ``data`` or ``indices`` datasets, or the HDF5
+                default, whichever is larger.
+
+            rdcc_nslots:
+                Number of slots in the hash table of the HDF5 chunk cache.
+                Defaults to the HDF5 default.
+
+                HDF5 only applies ``rdcc_nbytes`` and ``rdcc_nslots`` when
+                a dataset is first opened. If the dataset is already open,
+                e.g., by another seed for the same file, the existing cache
+                settings are used and a warning is raised.
+
+            transposed_group_name:
+                Name of a group in the same file containing the same matrix
+                in the other compressed orientation, e.g., as created by
+                :py:func:`~write_transposed_sparse_matrix`. If provided, each
+                extraction uses whichever representation requires fewer
+                non-zero elements to be read from file.
+
+            chunk_shape:
+                Tuple of length 2 specifying the chunk shape to report to
+                block-processing routines. Defaults to a single column (if
+                ``by_column = True``) or row (otherwise). Larger values can be
+                used to process multiple columns/rows in each block.
+
+            check_chunks:
+                Whether to warn if the chunks of the ``data`` or ``indices``
+                datasets are too large or too small for efficient extraction.
+                This is not done for the transposed representation, which is
+                expected to have the same chunk layout.
         """
         self._path = path
         self._group_name = group_name
@@ -82,40 +124,139 @@ class Hdf5CompressedSparseMatrixSeed:
             indptr_name = group_name + "/indptr"
         self._indptr_name = indptr_name
 
-        with File(self._path, "r") as handle:
-            self._indptr = handle[self._indptr_name][:]
-            if len(self._indptr.shape) != 1 or not issubdtype(self._indptr.dtype, integer):
-                raise ValueError("'indptr' dataset should be 1-dimensional and contain integers")
+        handle = self._acquire_file()
+
+        # Pointers are held in memory so that extraction only needs to
+        # touch the file for the 'data' and 'indices' datasets.
+        self._indptr = handle[self._indptr_name][()]
+        if len(self._indptr.shape) != 1 or not issubdtype(self._indptr.dtype, integer):
+            raise ValueError("'indptr' dataset should be 1-dimensional and contain integers")
+        # Pointers are used for indexing and arithmetic, so unsigned types
+        # (e.g., uint64 in 10x-style files) are converted to signed ones.
+        self._indptr = self._indptr.astype(intp, copy=False)
+        if by_column:
+            if len(self._indptr) != shape[1] + 1:
+                raise ValueError("'indptr' dataset should have length equal to the number of columns + 1")
+        else:
+            if len(self._indptr) != shape[0] + 1:
+                raise ValueError("'indptr' dataset should have length equal to the number of columns + 1")
+        if self._indptr[0] != 0:
+            raise ValueError("first entry of 'indptr' dataset should be zero")
+        self._nnz_per_primary = diff(self._indptr)
+        if (self._nnz_per_primary < 0).any():
+            raise ValueError("entries of 'indptr' should be ordered")
+        # Exposed by nnz_counts, so protected against modification.
+        self._nnz_per_primary.setflags(write=False)
+
+        ddset = handle[self._data_name]
+        if len(ddset.shape) != 1 or ddset.shape[0] != self._indptr[-1]:
+            raise ValueError("'data' dataset should have length equal to the number of non-zero elements")
+        self._modify_dtype = (dtype is not None and dtype != ddset.dtype)
+        if not self._modify_dtype:
+            dtype = ddset.dtype
+        self._dtype = dtype
+
+        # Not going to check for consistency of the indices themselves.
+        idset = handle[self._indices_name]
+        if len(idset.shape) != 1 or idset.shape[0] != self._indptr[-1]:
+            raise ValueError("'indices' dataset should have length equal to the number of non-zero elements")
+        if not issubdtype(idset.dtype, integer):
+            raise ValueError("'indices' dataset should contain integers")
+        self._modify_index_dtype = (index_dtype is not None and index_dtype != idset.dtype)
+        if not self._modify_index_dtype:
+            index_dtype = idset.dtype
+        self._index_dtype = index_dtype
+
+        if check_chunks:
+            _check_chunk_size(ddset)
+            _check_chunk_size(idset)
+        if rdcc_nbytes is None:
+            rdcc_nbytes = _default_cache_size(ddset, idset)
+        self._rdcc_nbytes = rdcc_nbytes
+        self._rdcc_nslots = rdcc_nslots
+
+        # HDF5 ignores the cache settings if a dataset is already open, so
+        # the handles used for inspection must be released first.
+        del ddset, idset
+        self._open_datasets(handle)
+
+        # Number of non-zero elements to read at once, chosen so that each
+        # batch of values and indices fits in the chunk cache.
+        batch_nnz = rdcc_nbytes // (self._h5_data.dtype.itemsize + self._h5_indices.dtype.itemsize)
+        if self._h5_data.chunks is not None:
+            batch_nnz = max(batch_nnz, self._h5_data.chunks[0])
+        self._batch_nnz = batch_nnz
+
+        if chunk_shape is None:
             if by_column:
-                if len(self._indptr) != shape[1] + 1:
-                    raise ValueError("'indptr' dataset should have length equal to the number of columns + 1")
+                chunk_shape = (shape[0], 1)
             else:
-                if len(self._indptr) != shape[0] + 1:
-                    raise ValueError("'indptr' dataset should have length equal to the number of columns + 1")
-            if self._indptr[0] != 0:
-                raise ValueError("first entry of 'indptr' dataset should be zero")
-            for i in range(1, len(self._indptr)):
-                if self._indptr[i] < self._indptr[i-1]:
-                    raise ValueError("entries of 'indptr' should be ordered")
-
-            ddset = handle[self._data_name]
-            if len(ddset.shape) != 1 or ddset.shape[0] != self._indptr[-1]:
-                raise ValueError("'data' dataset should have length equal to the number of non-zero elements")
-            self._modify_dtype = (dtype is not None and dtype != ddset.dtype)
-            if not self._modify_dtype:
-                dtype = ddset.dtype
-            self._dtype = dtype
-
-            # Not going to check for consistency of the indices themselves.
-            idset = handle[self._indices_name]
-            if len(idset.shape) != 1 or idset.shape[0] != self._indptr[-1]:
-                raise ValueError("'indices' dataset should have length equal to the number of non-zero elements")
-            if not issubdtype(idset.dtype, integer):
-                raise ValueError("'indices' dataset should contain integers")
-            self._modify_index_dtype = (index_dtype is not None and index_dtype != idset.dtype)
-            if not self._modify_index_dtype:
-                index_dtype = idset.dtype
-            self._index_dtype = index_dtype
+                chunk_shape = (1, shape[1])
+        elif len(chunk_shape) != 2:
+            raise ValueError("'chunk_shape' should have length 2")
+        self._chunks = (*chunk_shape,)
+
+        self._transposed_group_name = transposed_group_name
+        self._transposed = None
+        if transposed_group_name is not None:
+            self._transposed = Hdf5CompressedSparseMatrixSeed(
+                path, 
+                transposed_group_name, 
+                shape, 
+                not by_column, 
+                dtype=self._dtype, 
+                index_dtype=self._index_dtype,
+                rdcc_nbytes=rdcc_nbytes,
+                rdcc_nslots=rdcc_nslots,
+                check_chunks=False,
+            )
+            if self._transposed._indptr[-1] != self._indptr[-1]:
+                raise ValueError("transposed matrix should have the same number of non-zero elements")
+
+    def _acquire_file(self) -> File:
+        # The file handle is shared with all other seeds for the same file,
+        # and is closed once none of them are using it.
+        key, handle = _open_file(self._path)
+        self._finalizer = finalize(self, _release_file, key)
+        return handle
+
+    def _open_datasets(self, handle: File):
+        # Holding onto the dataset handles so that each extraction does not
+        # need to re-open the file or look up the datasets by name.
+        self._h5file = handle
+        self._h5_data = _open_dataset(handle, self._data_name, self._rdcc_nbytes, self._rdcc_nslots)
+        self._h5_indices = _open_dataset(handle, self._indices_name, self._rdcc_nbytes, self._rdcc_nslots)
+        # Values are converted to the requested type by HDF5 during the read
+        # where possible; indices are kept as-is as they are remapped before
+        # being returned.
+        self._data_reader = _range_reader(self._h5_data, self._dtype)
+        self._indices_reader = _range_reader(self._h5_indices)
+
+    def __getstate__(self):
+        # HDF5 handles cannot be pickled, so they are re-acquired from the
+        # path when unpickling.
+        state = self.__dict__.copy()
+        for name in ["_finalizer", "_h5file", "_h5_data", "_h5_indices", "_data_reader", "_indices_reader"]:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._nnz_per_primary.setflags(write=False) # not preserved by pickling.
+        self._open_datasets(self._acquire_file())
+
+    def close(self):
+        """Release this seed's handle to the HDF5 file. The file itself is
+        closed once no other seeds are using it. Any further extraction from
+        this seed will raise an error."""
+        self._data_reader = None
+        self._indices_reader = None
+        self._h5_data = None
+        self._h5_indices = None
+        self._h5file = None
+        _release_file_now(self._finalizer)
+        if self._transposed is not None:
+            self._transposed.close()
 
     @property
     def dtype(self) -> dtype:
@@ -190,6 +331,25 @@ class Hdf5CompressedSparseMatrixSeed:
         """
         return self._indptr_name
 
+    @property
+    def transposed_group_name(self) -> Optional[str]:
+        """
+        Returns:
+            Name of the HDF5 group containing the transposed representation
+            of the matrix, or None if there is no such representation.
+        """
+        return self._transposed_group_name
+
+    @property
+    def nnz_counts(self) -> ndarray:
+        """
+        Returns:
+            Number of non-zero elements in each column (if
+            :py:attr:`~by_column` is True) or row (otherwise). This is a
+            read-only array.
+        """
+        return self._nnz_per_primary
+
 
 @is_sparse.register
 def is_sparse_Hdf5CompressedSparseMatrixSeed(x: Hdf5CompressedSparseMatrixSeed):
@@ -200,68 +360,140 @@ def is_sparse_Hdf5CompressedSparseMatrixSeed(x: Hdf5CompressedSparseMatrixSeed):
 @chunk_shape.register
 def chunk_shape_Hdf5CompressedSparseMatrixSeed(x: Hdf5CompressedSparseMatrixSeed):
     """See :py:meth:`~delayedarray.chunk_shape.chunk_shape`."""
-    if x._by_column:
-        return (x._shape[0], 1)
-    else:
-        return (1, x._shape[1])
+    return x._chunks
+
+
+def _find_runs(x: Hdf5CompressedSparseMatrixSeed, primary_sub: Union[range, ndarray]) -> List[ndarray]:
+    """Find runs of primary elements in ``primary_sub`` that are stored
+    contiguously on disk, returned as arrays of positions into
+    ``primary_sub``. Elements without any non-zero entries are skipped."""
+    if len(primary_sub) == 0:
+        return []
+    if _is_contiguous_range(primary_sub):
+        return [arange(len(primary_sub))]
+
+    # Empty elements do not need to be read, and their absence allows the
+    # elements on either side to be merged into the same run.
+    primary = _subset_to_array(primary_sub)
+    positions = flatnonzero(x._nnz_per_primary[primary] > 0)
+    if len(positions) == 0:
+        return []
+    selected = primary[positions]
+    breaks = flatnonzero(x._indptr[selected[1:]] != x._indptr[selected[:-1] + 1]) + 1
+    return split(positions, breaks)
+
+
+def _run_pointers(x: Hdf5CompressedSparseMatrixSeed, selected: ndarray) -> ndarray:
+    ptrs = empty(len(selected) + 1, dtype=x._indptr.dtype)
+    ptrs[:-1] = x._indptr[selected]
+    ptrs[-1] = x._indptr[selected[-1] + 1]
+    return ptrs
+
+
+def _element_blocks(ptrs: ndarray, block_nnz: int) -> List[Tuple[int, int]]:
+    # Consecutive blocks of elements, each containing no more than
+    # 'block_nnz' non-zero elements. Always taking at least one element,
+    # even if it alone exceeds the block size.
+    output = []
+    current = 0
+    n = len(ptrs) - 1
+    while current < n:
+        last = searchsorted(ptrs, ptrs[current] + block_nnz, side="right") - 1
+        last = min(max(last, current + 1), n)
+        output.append((current, last))
+        current = last
+    return output
+
+
+def _split_runs(x: Hdf5CompressedSparseMatrixSeed, primary: ndarray, runs: List[ndarray]) -> List[ndarray]:
+    output = []
+    for run in runs:
+        ptrs = _run_pointers(x, primary[run])
+        if ptrs[-1] - ptrs[0] <= x._batch_nnz:
+            output.append(run)
+            continue
+        for first, last in _element_blocks(ptrs, x._batch_nnz):
+            output.append(run[first:last])
+    return output
 
 
 def _extract_array(
     x: Hdf5CompressedSparseMatrixSeed, 
-    primary_sub: Sequence[int], 
-    secondary_sub: Sequence[int], 
+    primary_sub: Union[range, ndarray], 
+    secondary_sub: Union[range, ndarray], 
     secondary_len: int, 
-    f_individual: Callable, 
-    f_consecutive: Callable
+    f_run: Callable,
 ):
     if len(secondary_sub) == 0:
         return
-    secondary_start = secondary_sub[0]
-    search_start = secondary_start > 0
-    secondary_end = secondary_sub[-1] + 1
-    search_end = secondary_end < secondary_len
-    is_consecutive = (search_end - search_start == len(secondary_sub))
-
-    with File(x._path, "r") as handle:
-        data = handle[x._data_name]
-        indices = handle[x._indices_name]
-
-        for i, p in enumerate(primary_sub):
-            start_pos = x._indptr[p]
-            end_pos = x._indptr[p + 1]
-            curdata = data[start_pos:end_pos]
-            curindices = indices[start_pos:end_pos]
-
-            start_idx = 0 
-            if search_start:
-                start_idx = bisect_left(curindices, secondary_start)
-            end_idx = len(curindices)
-            if search_end:
-                end_idx = bisect_left(curindices, secondary_end, lo=start_idx, hi=end_idx)
-
-            if is_consecutive:
-                mod_indices = curindices[start_idx:end_idx]
-                if search_start:
-                    mod_indices -= secondary_start
-                f_consecutive(i, mod_indices, curdata[start_idx:end_idx])
-            else:
-                p = 0
-                for j in range(start_idx, end_idx):
-                    curi = curindices[j]
-                    while p < len(secondary_sub) and secondary_sub[p] < curi:
-                        p += 1
-                    if p == len(secondary_sub):
-                        break
-                    if secondary_sub[p] == curi:
-                        f_individual(i, p, curdata[j])
-                        p += 1
+    primary_runs = _find_runs(x, primary_sub)
+    if len(primary_runs) == 0:
+        return
+    primary = _subset_to_array(primary_sub)
+
+    # Indices are remapped to their positions in 'secondary_sub', with -1
+    # for those that are not part of the subset.
+    is_full = (len(secondary_sub) == secondary_len)
+    lookup = None
+    if not is_full:
+        lookup = full(secondary_len, -1, dtype=intp)
+        if _is_contiguous_range(secondary_sub):
+            lookup[secondary_sub[0]:(secondary_sub[-1] + 1)] = arange(len(secondary_sub))
+        else:
+            lookup[_subset_to_array(secondary_sub)] = arange(len(secondary_sub))
+
+    # Each run is stored contiguously on disk, so it can be fetched in a
+    # single read and split up in memory. Long runs are processed in
+    # batches to cap the memory usage. Note that 'data' and 'indices' are
+    # deliberately read one after the other, as h5py serializes all HDF5
+    # calls behind a global lock and holds the GIL for most of the
+    # decompression, so concurrent reads are not faster.
+    for run in _split_runs(x, primary, primary_runs):
+        run_ptrs = _run_pointers(x, primary[run])
+        offset = run_ptrs[0]
+        block_data = x._data_reader(offset, run_ptrs[-1])
+        block_indices = x._indices_reader(offset, run_ptrs[-1])
+        run_ptrs -= offset
+
+        if not is_full:
+            block_indices, block_data, run_ptrs = _subset_run(block_indices, block_data, run_ptrs, lookup)
+
+        f_run(run, run_ptrs, block_indices, block_data)
+
+
+def _read_cost(x: Hdf5CompressedSparseMatrixSeed, subset: Tuple[Sequence[int], ...]) -> int:
+    primary_sub = subset[1] if x._by_column else subset[0]
+    if len(primary_sub) == 0:
+        return 0
+    if _is_contiguous_range(primary_sub):
+        return int(x._indptr[primary_sub[-1] + 1] - x._indptr[primary_sub[0]])
+    return int(x._nnz_per_primary[_subset_to_array(primary_sub)].sum())
+
+
+def _choose_representation(x: Hdf5CompressedSparseMatrixSeed, subset: Tuple[Sequence[int], ...]) -> Hdf5CompressedSparseMatrixSeed:
+    # Picking the representation that reads the fewest non-zero elements,
+    # which is the main determinant of I/O and decompression cost.
+    if x._transposed is None:
+        return x
+    if _read_cost(x._transposed, subset) < _read_cost(x, subset):
+        return x._transposed
+    return x
+
+
+def _expand_run(run: ndarray, ptrs: ndarray) -> ndarray:
+    # Positions in the primary subset for each element of a run.
+    return repeat(run, diff(ptrs))
 
 
 @extract_dense_array.register
 def extract_dense_array_Hdf5CompressedSparseMatrixSeed(x: Hdf5CompressedSparseMatrixSeed, subset: Optional[Tuple[Sequence[int], ...]] = None):
     """See :py:meth:`~delayedarray.extract_dense_array.extract_dense_array`."""
+    if x._h5file is None:
+        raise ValueError("seed has been closed")
     if subset is None:
         subset = (range(x.shape[0]), range(x.shape[1]))
+    subset = (_sanitize_subset(subset[0], x.shape[0]), _sanitize_subset(subset[1], x.shape[1]))
+    x = _choose_representation(x, subset)
 
     output = zeros((len(subset[0]), len(subset[1])), dtype=x.dtype, order="F")
 
@@ -270,27 +502,22 @@ def extract_dense_array_Hdf5CompressedSparseMatrixSeed(x: Hdf5CompressedSparseMa
         secondary_sub = subset[0]
         secondary_len = x.shape[0]
 
-        def _individual(c, r, value):
-            output[r,c] = value
-        def _consecutive(c, rows, values):
-            output[rows,c] = values
+        def _run(run, ptrs, rows, values):
+            output[rows, _expand_run(run, ptrs)] = values
     else:
         primary_sub = subset[0]
         secondary_sub = subset[1]
         secondary_len = x.shape[1]
 
-        def _individual(r, c, value):
-            output[r,c] = value
-        def _consecutive(r, cols, values):
-            output[r,cols] = values
+        def _run(run, ptrs, cols, values):
+            output[_expand_run(run, ptrs), cols] = values
 
     _extract_array(
         x=x, 
         primary_sub=primary_sub, 
         secondary_sub=secondary_sub, 
         secondary_len=secondary_len, 
-        f_individual=_individual, 
-        f_consecutive=_consecutive
+        f_run=_run,
     )
 
     return output
@@ -299,61 +526,68 @@ def extract_dense_array_Hdf5CompressedSparseMatrixSeed(x: Hdf5CompressedSparseMa
 @extract_sparse_array.register
 def extract_sparse_array_Hdf5CompressedSparseMatrixSeed(x: Hdf5CompressedSparseMatrixSeed, subset: Optional[Tuple[Sequence[int], ...]] = None):
     """See :py:meth:`~delayedarray.extract_sparse_array.extract_sparse_array`."""
+    if x._h5file is None:
+        raise ValueError("seed has been closed")
     if subset is None:
         subset = (range(x.shape[0]), range(x.shape[1]))
+    subset = (_sanitize_subset(subset[0], x.shape[0]), _sanitize_subset(subset[1], x.shape[1]))
+    x = _choose_representation(x, subset)
+
+    num_cols = len(subset[1])
+    output = [None] * num_cols
 
     if x._by_column: 
         primary_sub = subset[1]
         secondary_sub = subset[0]
-        primary_len = x.shape[1]
         secondary_len = x.shape[0]
+
+        def _run(run, ptrs, rows, values):
+            for j in range(len(ptrs) - 1):
+                start_pos = ptrs[j]
+                end_pos = ptrs[j + 1]
+                if start_pos < end_pos:
+                    output[run[j]] = (
+                        rows[start_pos:end_pos].astype(x._index_dtype, copy=False), 
+                        values[start_pos:end_pos].astype(x._dtype, copy=False),
+                    )
     else:
         primary_sub = subset[0]
         secondary_sub = subset[1]
-        primary_len = x.shape[0]
         secondary_len = x.shape[1]
 
-    output = []
-    for i in range(len(subset[1])):
-        output.append(([], []))
-
-    if x._by_column: 
-        def _individual(c, r, value):
-            output[c][0].append(r)
-            output[c][1].append(value)
-        def _consecutive(c, rows, values):
-            output[c] = (rows, values)
-    else:
-        def _individual(r, c, value):
-            output[c][0].append(r)
-            output[c][1].append(value)
-        def _consecutive(r, cols, values):
-            for j, c in enumerate(cols):
-                output[c][0].append(r)
-                output[c][1].append(values[j])
+        collected_rows = []
+        collected_cols = []
+        collected_values = []
+        def _run(run, ptrs, cols, values):
+            collected_rows.append(_expand_run(run, ptrs))
+            collected_cols.append(cols)
+            collected_values.append(values)
 
     _extract_array(
         x=x, 
         primary_sub=primary_sub, 
         secondary_sub=secondary_sub, 
         secondary_len=secondary_len, 
-        f_individual=_individual, 
-        f_consecutive=_consecutive
+        f_run=_run,
     )
 
-    all_none = True
-    for i, con in enumerate(output):
-        if len(con[0]) ==  0:
-            output[i] = None
-        else:
-            output[i] = (array(con[0], dtype=x._index_dtype, copy=False), array(con[1], dtype=x._dtype, copy=False))
-            all_none = False
-    if all_none:
+    if not x._by_column and len(collected_rows):
+        # Regrouping the row-major values by column. A stable sort keeps the
+        # row indices sorted within each column.
+        all_cols = concatenate(collected_cols).astype(intp, copy=False)
+        order = argsort(all_cols, kind="stable")
+        all_rows = concatenate(collected_rows)[order].astype(x._index_dtype, copy=False)
+        all_values = concatenate(collected_values)[order].astype(x._dtype, copy=False)
+        col_ptrs = zeros(num_cols + 1, dtype=intp)
+        cumsum(bincount(all_cols, minlength=num_cols), out=col_ptrs[1:])
+        for c in flatnonzero(col_ptrs[1:] > col_ptrs[:-1]):
+            output[c] = (all_rows[col_ptrs[c]:col_ptrs[c + 1]], all_values[col_ptrs[c]:col_ptrs[c + 1]])
+
+    if all(con is None for con in output):
         output = None
 
-    print(output)
     return SparseNdarray(
-        shape=(len(subset[0]), len(subset[1])), 
+        shape=(len(subset[0]), num_cols), 
         contents=output, 
         dtype=x._dtype, 
         index_dtype=x._index_dtype,
@@ -396,6 +630,11 @@ class Hdf5CompressedSparseMatrix(DelayedArray):
             seed = Hdf5CompressedSparseMatrixSeed(path, group_name, shape, by_column, **kwargs)
         super(Hdf5CompressedSparseMatrix, self).__init__(seed)
 
+    def close(self):
+        """Release the seed's handle to the HDF5 file, see
+        :py:meth:`~Hdf5CompressedSparseMatrixSeed.close`."""
+        self.seed.close()
+
     @property
     def path(self) -> str:
         """
@@ -453,8 +692,155 @@ class Hdf5CompressedSparseMatrix(DelayedArray):
         """
         return self.seed.indptr_name
 
+    @property
+    def transposed_group_name(self) -> Optional[str]:
+        """
+        Returns:
+            Name of the HDF5 group containing the transposed representation
+            of the matrix, or None if there is no such representation.
+        """
+        return self.seed.transposed_group_name
+
+    @property
+    def nnz_counts(self) -> ndarray:
+        """
+        Returns:
+            Number of non-zero elements in each column (if
+            :py:attr:`~by_column` is True) or row (otherwise).
+        """
+        return self.seed.nnz_counts
+
 
 @wrap.register
 def wrap_Hdf5CompressedSparseMatrixSeed(x: Hdf5CompressedSparseMatrixSeed):
     """See :py:meth:`~delayedarray.wrap.wrap`."""
     return Hdf5CompressedSparseMatrix(x, None, None, None)
+
+
+def write_transposed_sparse_matrix(
+    path: str, 
+    group_name: Optional[str], 
+    shape: Tuple[int, int],
+    by_column: bool,
+    transposed_group_name: str,
+    data_name: Optional[str] = None,
+    indices_name: Optional[str] = None,
+    indptr_name: Optional[str] = None,
+    block_nnz: int = 10000000,
+):
+    """Write the transposed representation of a compressed sparse matrix in
+    a HDF5 file, i.e., a compressed sparse row matrix for a compressed sparse
+    column matrix and vice versa. This can be used as the
+    ``transposed_group_name`` in :py:class:`~Hdf5CompressedSparseMatrixSeed`
+    for efficient access along both dimensions.
+
+    As the file is opened for writing, this should be called before any
+    seeds are constructed from ``path``.
+
+    Args:
+        path: 
+            Path to the HDF5 file.
+
+        group_name:
+            Name of the group containing the sparse matrix's contents.
+            This can also be None in which case ``data_name``,
+            ``indices_name`` and ``indptr_name`` should be specified.
+
+        shape:
+            Tuple of length 2 specifying the shape of the matrix.
+
+        by_column:
+            Whether the existing matrix is compressed sparse column.
+
+        transposed_group_name:
+            Name of the group in which to save the transposed representation.
+            This will contain the ``data``, ``indices`` and ``indptr`` datasets.
+
+        data_name:
+            Name of the dataset containing the data values. Defaults to
+            ``group_name`` plus ``/data``.
+
+        indices_name:
+            Name of the dataset containing the indices. Defaults to
+            ``group_name`` plus ``/indices``.
+
+        indptr_name:
+            Name of the dataset containing the pointers. Defaults to
+            ``group_name`` plus ``/indptr``.
+
+        block_nnz:
+            Number of non-zero elements to hold in memory at once. The
+            existing matrix is read once for each block of the transposed
+            representation, so larger values reduce the number of passes
+            through the file at the cost of memory.
+    """
+    if data_name is None:
+        data_name = group_name + "/data"
+    if indices_name is None:
+        indices_name = group_name + "/indices"
+    if indptr_name is None:
+        indptr_name = group_name + "/indptr"
+
+    if by_column:
+        primary_len, secondary_len = shape[1], shape[0]
+    else:
+        primary_len, secondary_len = shape[0], shape[1]
+
+    with File(path, "a") as handle:
+        ddset = handle[data_name]
+        idset = handle[indices_name]
+        indptr = handle[indptr_name][()]
+        ptrs = indptr.astype(intp, copy=False)
+        in_blocks = _element_blocks(ptrs, block_nnz)
+
+        # First pass counts the non-zero elements for each element of the
+        # transposed representation to obtain its pointers.
+        counts = zeros(secondary_len, dtype=intp)
+        for first, last in in_blocks:
+            counts += bincount(idset[ptrs[first]:ptrs[last]].astype(intp, copy=False), minlength=secondary_len)
+        new_indptr = zeros(secondary_len + 1, dtype=indptr.dtype)
+        cumsum(counts, out=new_indptr[1:])
+
+        nnz = int(new_indptr[-1])
+        index_dtype = promote_types(idset.dtype, min_scalar_type(max(primary_len - 1, 0)))
+        layout = dict(compression=ddset.compression, compression_opts=ddset.compression_opts)
+        if ddset.chunks is not None and nnz > 0:
+            layout["chunks"] = ddset.chunks
+        new_data = handle.create_dataset(transposed_group_name + "/data", shape=(nnz,), dtype=ddset.dtype, **layout)
+        new_indices = handle.create_dataset(transposed_group_name + "/indices", shape=(nnz,), dtype=index_dtype, **layout)
+        layout.pop("chunks", None)
+        handle.create_dataset(transposed_group_name + "/indptr", data=new_indptr, **layout)
+
+        # Second pass fills each block of the transposed representation in
+        # memory before writing it out, so that each write is contiguous.
+        out_ptrs = new_indptr.astype(intp, copy=False)
+        for out_first, out_last in _element_blocks(out_ptrs, block_nnz):
+            out_start = out_ptrs[out_first]
+            out_end = out_ptrs[out_last]
+            if out_start == out_end:
+                continue
+            block_data = empty(out_end - out_start, dtype=ddset.dtype)
+            block_indices = empty(out_end - out_start, dtype=index_dtype)
+            cursor = out_ptrs[out_first:out_last] - out_start
+
+            for first, last in in_blocks:
+                start, end = ptrs[first], ptrs[last]
+                indices = idset[start:end]
+                keep = flatnonzero((indices >= out_first) & (indices < out_last))
+                if len(keep) == 0:
+                    continue
+                primary = repeat(arange(first, last), diff(ptrs[first:(last + 1)]))[keep]
+                secondary = indices[keep].astype(intp, copy=False) - out_first
+
+                # A stable sort keeps the primary indices sorted within each
+                # element of the transposed representation.
+                order = argsort(secondary, kind="stable")
+                secondary = secondary[order]
+                group_starts = searchsorted(secondary, secondary, side="left")
+                dest = cursor[secondary] + arange(len(secondary)) - group_starts
+                block_indices[dest] = primary[order]
+                block_data[dest] = ddset[start:end][keep[order]]
+                cursor += bincount(secondary, minlength=len(cursor))
+
+            new_data[out_start:out_end] = block_data
+            new_indices[out_start:out_end] = block_indices
@@ -1,7 +1,10 @@
 from typing import Optional, Sequence, Tuple, Union
 from delayedarray import extract_dense_array, chunk_shape, DelayedArray, wrap
 from h5py import File
-from numpy import ndarray, dtype, asfortranarray, ix_
+from weakref import finalize
+from numpy import ndarray, dtype, asfortranarray, ix_, arange, empty
+
+from ._utils import _open_file, _release_file, _release_file_now, _open_dataset, _default_cache_size, _sanitize_subset, _is_contiguous_range, _hdf5_can_convert
 
 __author__ = "LTLA"
 __copyright__ = "LTLA"
@@ -11,7 +14,16 @@ __license__ = "MIT"
 class Hdf5DenseArraySeed:
     """HDF5-backed dataset as a ``DelayedArray`` dense array seed."""
 
-    def __init__(self, path: str, name: str, dtype: Optional[dtype] = None, native_order: bool = False) -> None:
+    def __init__(
+        self,
+        path: str,
+        name: str,
+        dtype: Optional[dtype] = None,
+        native_order: bool = False,
+        rdcc_nbytes: Optional[int] = None,
+        rdcc_nslots: Optional[int] = None,
+        chunk_shape: Optional[Tuple[int, ...]] = None,
+    ) -> None:
         """
         Args:
             path: 
@@ -33,36 +45,102 @@ class Hdf5DenseArraySeed:
                 If False, this array's shape is reversed compared to that reported in the
                 file, equivalent to Fortran storage order. In this case, the first 
                 dimension in this array will be the fastest changing one, etc.
+
+            rdcc_nbytes:
+                Size of the HDF5 chunk cache in bytes, used when reading
+                from the file. Defaults to 4 times the size of a chunk of the
+                dataset, or the HDF5 default, whichever is larger.
+
+            rdcc_nslots:
+                Number of slots in the hash table of the HDF5 chunk cache.
+                Defaults to the HDF5 default.
+
+                HDF5 only applies ``rdcc_nbytes`` and ``rdcc_nslots`` when
+                a dataset is first opened. If the dataset is already open,
+                e.g., by another seed for the same file, the existing cache
+                settings are used and a warning is raised.
+
+            chunk_shape:
+                Tuple specifying the chunk shape to report to block-processing
+                routines, in the same order as this array's dimensions.
+                Defaults to the chunk shape on disk, which may be too small
+                for efficient processing; multiples of the on-disk chunk
+                shape are recommended.
         """
         self._path = path
         self._name = name
         self._native_order = native_order
 
-        with File(self._path, "r") as handle:
-            dset = handle[name]
+        handle = self._acquire_file()
+        dset = handle[name]
 
-            self._modify_dtype = (dtype is not None and dtype != dset.dtype)
-            if not self._modify_dtype:
-                dtype = dset.dtype
-            self._dtype = dtype
+        self._modify_dtype = (dtype is not None and dtype != dset.dtype)
+        if not self._modify_dtype:
+            dtype = dset.dtype
+        self._dtype = dtype
+
+        if native_order:
+            self._shape = dset.shape
+        else:
+            self._shape = (*list(reversed(dset.shape)),)
 
+        if chunk_shape is not None:
+            if len(chunk_shape) != len(self._shape):
+                raise ValueError("'chunk_shape' should have length equal to the number of dimensions")
+            self._chunks = (*chunk_shape,)
+        elif dset.chunks is not None:
             if native_order:
-                self._shape = dset.shape
+                self._chunks = dset.chunks
             else:
-                self._shape = (*list(reversed(dset.shape)),)
-
-            if dset.chunks is not None:
-                if native_order:
-                    self._chunks = dset.chunks
-                else:
-                    self._chunks = (*list(reversed(dset.chunks)),)
+                self._chunks = (*list(reversed(dset.chunks)),)
+        else:
+            chunk_sizes = [1] * len(self._shape)
+            if native_order:
+                chunk_sizes[-1] = self._shape[-1]
             else:
-                chunk_sizes = [1] * len(self._shape)
-                if native_order:
-                    chunk_sizes[-1] = self._shape[-1]
-                else:
-                    chunk_sizes[0] = self._shape[0]
-                self._chunks = (*chunk_sizes,)
+                chunk_sizes[0] = self._shape[0]
+            self._chunks = (*chunk_sizes,)
+
+        if rdcc_nbytes is None:
+            rdcc_nbytes = _default_cache_size(dset)
+        self._rdcc_nbytes = rdcc_nbytes
+        self._rdcc_nslots = rdcc_nslots
+
+        # HDF5 ignores the cache settings if the dataset is already open, so
+        # the handle used for inspection must be released first.
+        del dset
+        self._open_datasets(handle)
+
+    def _acquire_file(self) -> File:
+        # The file handle is shared with all other seeds for the same file,
+        # and is closed once none of them are using it.
+        key, handle = _open_file(self._path)
+        self._finalizer = finalize(self, _release_file, key)
+        return handle
+
+    def _open_datasets(self, handle: File):
+        self._h5file = handle
+        self._h5_dset = _open_dataset(handle, self._name, self._rdcc_nbytes, self._rdcc_nslots)
+
+    def __getstate__(self):
+        # HDF5 handles cannot be pickled, so they are re-acquired from the
+        # path when unpickling.
+        state = self.__dict__.copy()
+        for name in ["_finalizer", "_h5file", "_h5_dset"]:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open_datasets(self._acquire_file())
+
+    def close(self):
+        """Release this seed's handle to the HDF5 file. The file itself is
+        closed once no other seeds are using it. Any further extraction from
+        this seed will raise an error."""
+        self._h5_dset = None
+        self._h5file = None
+        _release_file_now(self._finalizer)
 
     @property
     def dtype(self) -> dtype:
@@ -106,6 +184,8 @@ def chunk_shape_Hdf5DenseArraySeed(x: Hdf5DenseArraySeed):
 @extract_dense_array.register
 def extract_dense_array_Hdf5DenseArraySeed(x: Hdf5DenseArraySeed, subset: Optional[Tuple[Sequence[int], ...]] = None):
     """See :py:meth:`~delayedarray.extract_dense_array.extract_dense_array`."""
+    if x._h5file is None:
+        raise ValueError("seed has been closed")
     converted = []
     reextract = None
 
@@ -114,9 +194,12 @@ def extract_dense_array_Hdf5DenseArraySeed(x: Hdf5DenseArraySeed, subset: Option
             converted.append(slice(s))
     else:
         num_lists = 0
-        for s in subset:
+        for i, s in enumerate(subset):
+            s = _sanitize_subset(s, x._shape[i])
             if isinstance(s, range): # convert back to slice for HDF5 access efficiency.
                 converted.append(slice(s.start, s.stop, s.step))
+            elif len(s) and _is_contiguous_range(s):
+                converted.append(slice(s[0], s[-1] + 1))
             else:
                 num_lists += 1
                 converted.append(s)
@@ -129,7 +212,7 @@ def extract_dense_array_Hdf5DenseArraySeed(x: Hdf5DenseArraySeed, subset: Option
             chosen = 0
             for i, s in enumerate(converted):
                 if not isinstance(s, slice) and len(s):
-                    lowest = s[1]
+                    lowest = s[0]
                     highest = s[-1]
                     current_density = (highest - lowest) / len(s)
                     if lowest_density > current_density:
@@ -139,24 +222,36 @@ def extract_dense_array_Hdf5DenseArraySeed(x: Hdf5DenseArraySeed, subset: Option
             reextract = []
             for i, s in enumerate(converted):
                 if isinstance(s, slice) or i == chosen:
-                    reextract.append(range(len(subset[i])))
+                    reextract.append(None)
                 else:
                     lowest = s[0]
                     highest = s[-1]
                     converted[i] = slice(lowest, highest + 1)
-                    reextract.append([j - lowest for j in s])
-
-    # Re-opening the handle as needed, so as to avoid
-    # blocking other applications that need this file.
-    with File(x._path, "r") as handle:
-        dset = handle[x._name]
-        if x._native_order:
-            out = dset[(*converted,)]
-        else:
-            converted.reverse()
-            out = dset[(*converted,)].T
+                    reextract.append(s - lowest)
+
+    if not x._native_order:
+        converted.reverse()
+
+    if all(isinstance(s, slice) for s in converted):
+        # Reading straight into a preallocated buffer of the final type, so
+        # HDF5 performs the type conversion and no intermediate is created.
+        # Other conversions are left to the astype() call below.
+        # The transpose of a C-contiguous buffer is already Fortran-ordered.
+        disk_shape = x._h5_dset.shape
+        buffer_dtype = x._dtype if _hdf5_can_convert(x._h5_dset.dtype, x._dtype) else x._h5_dset.dtype
+        out = empty(tuple(len(range(*s.indices(disk_shape[i]))) for i, s in enumerate(converted)), dtype=buffer_dtype)
+        if out.size:
+            x._h5_dset.read_direct(out, source_sel=(*converted,))
+    else:
+        out = x._h5_dset[(*converted,)]
+
+    if not x._native_order:
+        out = out.T
 
     if reextract is not None:
+        for i, r in enumerate(reextract):
+            if r is None:
+                reextract[i] = arange(out.shape[i])
         out = out[ix_(*reextract)]
 
     # Making other transformations for consistency.
@@ -194,6 +289,11 @@ class Hdf5DenseArray(DelayedArray):
             seed = Hdf5DenseArraySeed(path, name, **kwargs)
         super(Hdf5DenseArray, self).__init__(seed)
 
+    def close(self):
+        """Release the seed's handle to the HDF5 file, see
+        :py:meth:`~Hdf5DenseArraySeed.close`."""
+        self.seed.close()
+
     @property
     def path(self) -> str:
         """
@@ -0,0 +1,80 @@
+from typing import Tuple
+from numpy import ndarray, zeros, empty, cumsum, intp
+
+__author__ = "LTLA"
+__copyright__ = "LTLA"
+__license__ = "MIT"
+
+
+def _subset_run_numpy(indices: ndarray, data: ndarray, ptrs: ndarray, lookup: ndarray) -> Tuple[ndarray, ndarray, ndarray]:
+    remapped = lookup[indices]
+    keep = remapped >= 0
+    kept = zeros(len(keep) + 1, dtype=intp)
+    cumsum(keep, out=kept[1:])
+    return remapped[keep], data[keep], kept[ptrs]
+
+
+try:
+    from numba import njit, prange
+except ImportError:  # pragma: no cover
+    njit = None
+
+
+if njit is not None:
+    @njit(cache=True, parallel=True)
+    def _subset_run_numba(indices, data, ptrs, lookup):  # pragma: no cover
+        n = len(ptrs) - 1
+
+        # First pass counts the surviving entries for each primary element,
+        # which gives the output pointers and the write position of each
+        # primary element in the second pass.
+        out_ptrs = zeros(n + 1, dtype=intp)
+        for j in prange(n):
+            count = 0
+            for k in range(ptrs[j], ptrs[j + 1]):
+                if lookup[indices[k]] >= 0:
+                    count += 1
+            out_ptrs[j + 1] = count
+        for j in range(n):
+            out_ptrs[j + 1] += out_ptrs[j]
+
+        out_indices = empty(out_ptrs[n], dtype=intp)
+        out_data = empty(out_ptrs[n], dtype=data.dtype)
+        for j in prange(n):
+            pos = out_ptrs[j]
+            for k in range(ptrs[j], ptrs[j + 1]):
+                mapped = lookup[indices[k]]
+                if mapped >= 0:
+                    out_indices[pos] = mapped
+                    out_data[pos] = data[k]
+                    pos += 1
+
+        return out_indices, out_data, out_ptrs
+
+
+def _subset_run(indices: ndarray, data: ndarray, ptrs: ndarray, lookup: ndarray) -> Tuple[ndarray, ndarray, ndarray]:
+    """Subset the secondary dimension of a run of primary elements.
+
+    Args:
+        indices:
+            Secondary indices for all non-zero elements in the run.
+
+        data:
+            Values for all non-zero elements in the run.
+
+        ptrs:
+            Pointers to the start of each primary element in ``indices``
+            and ``data``, plus the end of the run.
+
+        lookup:
+            Array mapping each secondary index to its position in the
+            subset, or -1 if it is not part of the subset.
+
+    Returns:
+        Tuple containing the remapped indices, the values and the pointers
+        for the surviving non-zero elements. This uses a Numba-compiled
+        kernel if **numba** is installed.
+    """
+    if njit is None:
+        return _subset_run_numpy(indices, data, ptrs, lookup)
+    return _subset_run_numba(indices, data, ptrs, lookup)
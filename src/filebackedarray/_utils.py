@@ -0,0 +1,240 @@
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+from collections import deque
+from os import stat, sep
+from os.path import abspath, dirname
+from threading import Lock
+from weakref import finalize
+from sys import _getframe
+from warnings import warn
+from h5py import File, Dataset, h5d, h5p, h5s, h5t
+from numpy import ndarray, dtype, prod, arange, asarray, intp, empty, can_cast
+
+try:
+    from h5py._selector import Reader
+except ImportError:  # pragma: no cover
+    Reader = None
+
+__author__ = "LTLA"
+__copyright__ = "LTLA"
+__license__ = "MIT"
+
+
+_package_dir = dirname(abspath(__file__)) + sep
+
+
+def _warn(message: str):
+    # Pointing the warning at the first caller outside of this package, so
+    # that it refers to the user's code regardless of how it was reached.
+    level = 2
+    frame = _getframe(1)
+    while frame is not None and frame.f_code.co_filename.startswith(_package_dir):
+        frame = frame.f_back
+        level += 1
+    warn(message, stacklevel=level)
+
+
+# File handles are shared between all seeds referring to the same file. Each
+# seed holds a reference that is released by close() or when the seed is
+# garbage-collected, and the file is closed once all references are gone.
+# The file's identity is part of the key, so that a file that was replaced
+# at the same path is not served by the stale handle for the old file.
+_open_files = {}
+_open_files_lock = Lock()
+
+# Releases that could not acquire the lock, processed by the next caller
+# that does. Finalizers can run whenever garbage collection is triggered,
+# including in a thread that already holds the lock, so they never block.
+_pending_releases = deque()
+
+
+def _file_key(path: str) -> Tuple[str, int, int, int]:
+    info = stat(path)
+    return (abspath(path), info.st_dev, info.st_ino, info.st_mtime_ns)
+
+
+def _process_pending_releases() -> List[File]:
+    # Must be called with the lock held. Files are closed by the caller
+    # after releasing the lock.
+    to_close = []
+    while _pending_releases:
+        key = _pending_releases.popleft()
+        entry = _open_files[key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _open_files[key]
+            to_close.append(entry[0])
+    return to_close
+
+
+def _open_file(path: str) -> Tuple[Tuple[str, int, int, int], File]:
+    key = _file_key(path)
+    with _open_files_lock:
+        to_close = _process_pending_releases()
+        entry = _open_files.get(key)
+        if entry is not None:
+            entry[1] += 1
+    for handle in to_close:
+        handle.close()
+    if entry is not None:
+        return key, entry[0]
+
+    # Opening the file outside the lock, as this may trigger garbage
+    # collection and thus the finalizers of other seeds.
+    handle = File(path, "r")
+    with _open_files_lock:
+        to_close = _process_pending_releases()
+        entry = _open_files.get(key)
+        if entry is None:
+            entry = [handle, 0]
+            _open_files[key] = entry
+        else:
+            to_close.append(handle) # another thread opened it first.
+        entry[1] += 1
+    for extra in to_close:
+        extra.close()
+    return key, entry[0]
+
+
+def _release_file(key: Tuple[str, int, int, int], blocking: bool = False):
+    # Only blocks when called from close(), which promises that the file is
+    # closed once no other seeds are using it.
+    _pending_releases.append(key)
+    if not _open_files_lock.acquire(blocking=blocking):
+        return
+    try:
+        to_close = _process_pending_releases()
+    finally:
+        _open_files_lock.release()
+    for handle in to_close:
+        handle.close()
+
+
+def _release_file_now(finalizer: finalize):
+    # Detaching so that the non-blocking release in the finalizer is not
+    # also run when the seed is garbage-collected.
+    info = finalizer.detach()
+    if info is not None:
+        _release_file(*info[2], blocking=True)
+
+
+def _open_dataset(handle: File, name: str, rdcc_nbytes: Optional[int], rdcc_nslots: Optional[int]) -> Dataset:
+    # Chunk cache settings are applied per dataset, as the file handle may
+    # be shared with other seeds that use different settings.
+    _, default_nslots, default_nbytes, w0 = handle.id.get_access_plist().get_cache()
+    if rdcc_nbytes is None:
+        rdcc_nbytes = default_nbytes
+    if rdcc_nslots is None:
+        rdcc_nslots = default_nslots
+    dapl = h5p.create(h5p.DATASET_ACCESS)
+    dapl.set_chunk_cache(rdcc_nslots, rdcc_nbytes, w0)
+    dset = Dataset(h5d.open(handle.id, name.encode(), dapl))
+
+    # HDF5 ignores the access property list if the dataset is already open,
+    # e.g., by another seed for the same file.
+    actual_nslots, actual_nbytes, _ = dset.id.get_access_plist().get_chunk_cache()
+    if actual_nslots != rdcc_nslots or actual_nbytes != rdcc_nbytes:
+        _warn("chunk cache settings for '" + name + "' were ignored as the dataset is already open, using " + str(actual_nbytes) + " bytes and " + str(actual_nslots) + " slots instead")
+    return dset
+
+
+def _chunk_nbytes(dset: Dataset) -> int:
+    if dset.chunks is None:
+        return 0
+    return int(prod(dset.chunks)) * dset.dtype.itemsize
+
+
+# Bounds on the chunk size for compressed sparse datasets. Larger chunks
+# mean that even small extractions must decompress a lot of data, while
+# smaller chunks incur a lot of per-chunk overhead for large datasets.
+_MAX_CHUNK_NBYTES = 4 * 1024**2
+_MIN_CHUNK_NBYTES = 16 * 1024
+_MIN_CHUNK_DATASET_NBYTES = 1024**2
+
+
+def _check_chunk_size(dset: Dataset):
+    nbytes = _chunk_nbytes(dset)
+    if nbytes == 0:
+        return
+    if nbytes > _MAX_CHUNK_NBYTES:
+        _warn("chunks of '" + dset.name + "' are " + str(nbytes) + " bytes, so each read may decompress much more data than it needs")
+    elif nbytes < _MIN_CHUNK_NBYTES and dset.size * dset.dtype.itemsize > _MIN_CHUNK_DATASET_NBYTES:
+        _warn("chunks of '" + dset.name + "' are " + str(nbytes) + " bytes, so large reads will be dominated by per-chunk overhead")
+
+
+def _default_cache_size(*dsets: Dataset) -> int:
+    # Enough to hold a few chunks of the largest dataset, so that repeated
+    # reads into the same region do not decompress the same chunks again.
+    largest = max(_chunk_nbytes(d) for d in dsets)
+    default_nbytes = dsets[0].file.id.get_access_plist().get_cache()[2]
+    return max(4 * largest, default_nbytes)
+
+
+def _hdf5_can_convert(source: dtype, target: dtype) -> bool:
+    """Whether HDF5 can convert from ``source`` to ``target`` during a read
+    with the same results as NumPy's ``astype``. This is only guaranteed for
+    widening casts between numeric types, as HDF5 saturates on overflow and
+    does not support conversion to booleans."""
+    source = dtype(source)
+    target = dtype(target)
+    return source.kind in "iuf" and target.kind in "iuf" and can_cast(source, target, "safe")
+
+
+def _range_reader(dset: Dataset, dtype: Optional[dtype] = None) -> Callable[[int, int], ndarray]:
+    convert = dtype is not None and dtype != dset.dtype
+    if convert and _hdf5_can_convert(dset.dtype, dtype):
+        # Reading straight into a buffer of the requested type, so that HDF5
+        # converts the values during the read instead of creating a copy.
+        mtype = h5t.py_create(dtype)
+        def _read(start, end):
+            out = empty(end - start, dtype=dtype)
+            if end > start:
+                fspace = dset.id.get_space()
+                fspace.select_hyperslab((start,), (end - start,))
+                mspace = h5s.create_simple((end - start,))
+                dset.id.read(mspace, fspace, out, mtype=mtype)
+            return out
+        return _read
+
+    # Otherwise using h5py's low-level reader where possible, which skips
+    # the selection parsing overhead of Dataset.__getitem__ for small reads.
+    if Reader is not None and dset.dtype.kind in "iuf":
+        reader = Reader(dset.id)
+        def _read_native(start, end):
+            return reader.read((slice(start, end),))
+    else:  # pragma: no cover
+        def _read_native(start, end):
+            return dset[start:end]
+
+    if not convert:
+        return _read_native
+
+    # Any other conversion is done by NumPy, as HDF5's results differ.
+    def _read(start, end):
+        return _read_native(start, end).astype(dtype, copy=False)
+    return _read
+
+
+def _sanitize_subset(sub: Union[slice, Sequence[int]], length: int) -> Union[range, ndarray]:
+    # Ranges are kept as-is (and slices are converted to ranges) so that
+    # consecutive subsets can be recognized without inspecting each element;
+    # everything else becomes an array.
+    if isinstance(sub, slice):
+        return range(*sub.indices(length))
+    if isinstance(sub, (range, ndarray)):
+        return sub
+    return asarray(sub, dtype=intp)
+
+
+def _subset_to_array(sub: Union[range, ndarray]) -> ndarray:
+    if isinstance(sub, range):
+        return arange(sub.start, sub.stop, sub.step)
+    return sub
+
+
+def _is_contiguous_range(sub: Union[range, ndarray]) -> bool:
+    """Whether a sorted and unique subset contains consecutive integers."""
+    if len(sub) <= 1:
+        return True
+    if isinstance(sub, range):
+        return sub.step == 1
+    return sub[-1] - sub[0] + 1 == len(sub)
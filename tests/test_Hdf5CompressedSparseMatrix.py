@@ -1,9 +1,14 @@
 import numpy
 import h5py
-from filebackedarray import Hdf5CompressedSparseMatrix
+from filebackedarray import Hdf5CompressedSparseMatrix, Hdf5CompressedSparseMatrixSeed, write_transposed_sparse_matrix
+from filebackedarray.Hdf5CompressedSparseMatrixSeed import _choose_representation, _find_runs
 import delayedarray
 import tempfile
 import scipy.sparse
+import pytest
+import pickle
+import copy
+import warnings
 
 __author__ = "jkanche"
 __copyright__ = "jkanche"
@@ -105,6 +110,251 @@ def test_Hdf5CompressedSparseMatrix_dtype():
     assert as_sparse.dtype == numpy.int16
     assert as_sparse.index_dtype == numpy.uint8
 
+    slices = (slice(5, 50, 2), slice(10, 40))
+    ref = y[slices].toarray()
+    ranges = [range(*s.indices(shape[i])) for i, s in enumerate(slices)]
+    as_dense = delayedarray.extract_dense_array(arr, (*ranges,))
+    assert (as_dense == ref).all()
+    assert as_dense.dtype == numpy.int16
+    as_sparse = delayedarray.extract_sparse_array(arr, (*ranges,))
+    assert (numpy.array(as_sparse) == ref).all()
+    assert as_sparse.dtype == numpy.int16
+
+    # Conversions that HDF5 does not perform like NumPy.
+    y = (scipy.sparse.random(*shape, 0.2) * 1000).tocsc().astype(numpy.int32)
+    path, group = _mockup(y)
+    for dt in [numpy.bool_, numpy.int8]:
+        arr = Hdf5CompressedSparseMatrix(path, group, shape=shape, by_column=True, dtype=dt)
+        ref = y.toarray().astype(dt)
+        as_dense = delayedarray.extract_dense_array(arr)
+        assert as_dense.dtype == dt
+        assert (as_dense == ref).all()
+        as_sparse = delayedarray.extract_sparse_array(arr, (range(5, 50, 2), range(10, 40)))
+        assert as_sparse.dtype == dt
+        assert (numpy.array(as_sparse) == ref[5:50:2, 10:40]).all()
+
+
+def test_Hdf5CompressedSparseMatrix_unsigned():
+    shape = (100, 200)
+    y = scipy.sparse.random(*shape, 0.1).tocsr()
+
+    for mat, by_column in [(y, False), (y.tocsc(), True)]:
+        _, path = tempfile.mkstemp(suffix=".h5")
+        with h5py.File(path, "w") as handle:
+            handle.create_dataset("whee/data", data=mat.data, compression="gzip")
+            handle.create_dataset("whee/indices", data=mat.indices.astype(numpy.uint64), compression="gzip")
+            handle.create_dataset("whee/indptr", data=mat.indptr.astype(numpy.uint64), compression="gzip")
+
+        # SparseNdarray can't be converted to a NumPy array with unsigned indices.
+        arr = Hdf5CompressedSparseMatrix(path, "whee", shape=shape, by_column=by_column, index_dtype=numpy.int64)
+        assert (delayedarray.extract_dense_array(arr) == y.toarray()).all()
+        assert (numpy.array(delayedarray.extract_sparse_array(arr)) == y.toarray()).all()
+
+        for slices in [(slice(10, 50), slice(0, 200)), (slice(3, 90, 3), slice(4, 160, 5))]:
+            ref = y[slices].toarray()
+            ranges = [range(*s.indices(shape[i])) for i, s in enumerate(slices)]
+            assert (delayedarray.extract_dense_array(arr, (*ranges,)) == ref).all()
+            assert (numpy.array(delayedarray.extract_sparse_array(arr, (*ranges,))) == ref).all()
+
+
+def test_Hdf5CompressedSparseMatrix_batched():
+    shape = (100, 200)
+    y = scipy.sparse.random(*shape, 0.1).tocsr()
+    path, group = _mockup(y)
+    arr = Hdf5CompressedSparseMatrix(path, group, shape=shape, by_column=False)
+    arr.seed._batch_nnz = 50 # forcing multiple batches per run.
+
+    assert (delayedarray.extract_dense_array(arr) == y.toarray()).all()
+    assert (numpy.array(delayedarray.extract_sparse_array(arr)) == y.toarray()).all()
+
+    slices = (slice(10, 80), slice(50, 150, 3))
+    ref = y[slices].toarray()
+    ranges = [range(*s.indices(shape[i])) for i, s in enumerate(slices)]
+    assert (delayedarray.extract_dense_array(arr, (*ranges,)) == ref).all()
+    assert (numpy.array(delayedarray.extract_sparse_array(arr, (*ranges,))) == ref).all()
+
+
+def test_Hdf5CompressedSparseMatrix_chunk_cache():
+    shape = (100, 200)
+    y = scipy.sparse.random(*shape, 0.1).tocsr()
+    path, group = _mockup(y)
+    arr = Hdf5CompressedSparseMatrix(path, group, shape=shape, by_column=False, rdcc_nbytes=12345, rdcc_nslots=7)
+    assert arr.seed._h5_data.id.get_access_plist().get_chunk_cache()[:2] == (7, 12345)
+    assert arr.seed._h5_indices.id.get_access_plist().get_chunk_cache()[:2] == (7, 12345)
+    assert (delayedarray.extract_dense_array(arr) == y.toarray()).all()
+
+    slices = (slice(3, 90, 3), slice(4, 160, 5))
+    ref = y[slices].toarray()
+    ranges = [range(*s.indices(shape[i])) for i, s in enumerate(slices)]
+    assert (numpy.array(delayedarray.extract_sparse_array(arr, (*ranges,))) == ref).all()
+
+    # Default is large enough to hold several chunks of 'data'.
+    _, path = tempfile.mkstemp(suffix=".h5")
+    data_chunk = 300000
+    with h5py.File(path, "w") as handle:
+        handle.create_dataset("whee/data", data=y.data, chunks=(data_chunk,), maxshape=(None,))
+        handle.create_dataset("whee/indices", data=y.indices, chunks=(100,))
+        handle.create_dataset("whee/indptr", data=y.indptr)
+    arr = Hdf5CompressedSparseMatrix(path, "whee", shape=shape, by_column=False)
+    assert arr.seed._h5_data.id.get_access_plist().get_chunk_cache()[1] == 4 * data_chunk * y.data.dtype.itemsize
+    assert (delayedarray.extract_dense_array(arr) == y.toarray()).all()
+
+
+def test_Hdf5CompressedSparseMatrix_empty_majors():
+    # Only every 10th primary element has any non-zero entries.
+    shape = (300, 50)
+    y = scipy.sparse.random(*shape, 0.5).tolil()
+    y[numpy.arange(shape[0]) % 10 != 0, :] = 0
+    y = y.tocsr()
+    y.eliminate_zeros()
+
+    # Subset includes empty elements, gaps consisting only of empty
+    # elements, and gaps that skip over non-empty elements.
+    rows = numpy.array([1, 10, 13, 20, 25, 30, 55, 60, 65, 70, 200, 295])
+    cols = numpy.array([0, 3, 4, 10, 25, 49])
+
+    for mat, by_column, sub in [(y, False, (rows, cols)), (y.T.tocsc(), True, (cols, rows))]:
+        path, group = _mockup(mat)
+        arr = Hdf5CompressedSparseMatrix(path, group, shape=mat.shape, by_column=by_column)
+
+        # Non-empty rows 10, 20 and 30 are adjacent on disk, as are 60 and
+        # 70, while the other gaps skip over non-empty rows.
+        runs = _find_runs(arr.seed, rows)
+        assert [list(rows[r]) for r in runs] == [[10, 20, 30], [60, 70], [200]]
+
+        ref = mat.toarray()[numpy.ix_(*sub)]
+        assert (delayedarray.extract_dense_array(arr, sub) == ref).all()
+        assert (numpy.array(delayedarray.extract_sparse_array(arr, sub)) == ref).all()
+
+        # Also with subsets consisting only of empty elements.
+        empty_rows = numpy.array([1, 2, 15, 99])
+        empty_sub = (empty_rows, cols) if not by_column else (cols, empty_rows)
+        assert _find_runs(arr.seed, empty_rows) == []
+        assert (delayedarray.extract_dense_array(arr, empty_sub) == 0).all()
+        assert (numpy.array(delayedarray.extract_sparse_array(arr, empty_sub)) == 0).all()
+
+
+def test_Hdf5CompressedSparseMatrix_transposed():
+    shape = (100, 200)
+    y = scipy.sparse.random(*shape, 0.1).tocsr()
+    path, group = _mockup(y)
+    write_transposed_sparse_matrix(path, group, shape=shape, by_column=False, transposed_group_name="trans")
+
+    with h5py.File(path, "r") as handle:
+        ref = y.tocsc()
+        assert (handle["trans/indptr"][:] == ref.indptr).all()
+        assert (handle["trans/indices"][:] == ref.indices).all()
+        assert (handle["trans/data"][:] == ref.data).all()
+
+    arr = Hdf5CompressedSparseMatrix(path, group, shape=shape, by_column=False, transposed_group_name="trans")
+    assert arr.transposed_group_name == "trans"
+    assert arr.seed._transposed.by_column
+    assert delayedarray.chunk_shape(arr) == (1, 200)
+    assert (delayedarray.extract_dense_array(arr) == y.toarray()).all()
+
+    # Column-wise access uses the transposed representation.
+    slices = (slice(0, 100), slice(50, 60))
+    ref = y[slices].toarray()
+    ranges = [range(*s.indices(shape[i])) for i, s in enumerate(slices)]
+    assert _choose_representation(arr.seed, (*ranges,)) is arr.seed._transposed
+    assert (delayedarray.extract_dense_array(arr, (*ranges,)) == ref).all()
+    assert (numpy.array(delayedarray.extract_sparse_array(arr, (*ranges,))) == ref).all()
+
+    # Row-wise access uses the original representation.
+    slices = (slice(10, 12), slice(0, 200, 3))
+    ref = y[slices].toarray()
+    ranges = [range(*s.indices(shape[i])) for i, s in enumerate(slices)]
+    assert _choose_representation(arr.seed, (*ranges,)) is arr.seed
+    assert (delayedarray.extract_dense_array(arr, (*ranges,)) == ref).all()
+    assert (numpy.array(delayedarray.extract_sparse_array(arr, (*ranges,))) == ref).all()
+
+    # Closing releases the handles for both representations.
+    arr.close()
+    with pytest.raises(ValueError, match="closed"):
+        delayedarray.extract_dense_array(arr)
+    with pytest.raises(ValueError, match="closed"):
+        delayedarray.extract_sparse_array(arr)
+    write_transposed_sparse_matrix(path, group, shape=shape, by_column=False, transposed_group_name="trans2")
+
+    # Building the transposed representation in blocks, with the chunk
+    # layout of the source datasets.
+    y = scipy.sparse.random(*shape, 0.1).tolil()
+    y[50:60, :] = 0 # some empty rows in the transposed representation.
+    y = y.tocsc()
+    y.eliminate_zeros()
+    _, path = tempfile.mkstemp(suffix=".h5")
+    with h5py.File(path, "w") as handle:
+        handle.create_dataset("whee/data", data=y.data, chunks=(100,), compression="gzip")
+        handle.create_dataset("whee/indices", data=y.indices.astype(numpy.uint64), chunks=(100,), compression="gzip")
+        handle.create_dataset("whee/indptr", data=y.indptr.astype(numpy.uint64))
+    write_transposed_sparse_matrix(path, "whee", shape=shape, by_column=True, transposed_group_name="trans", block_nnz=150)
+
+    with h5py.File(path, "r") as handle:
+        ref = y.tocsr()
+        assert (handle["trans/indptr"][:] == ref.indptr).all()
+        assert (handle["trans/indices"][:] == ref.indices).all()
+        assert (handle["trans/data"][:] == ref.data).all()
+        assert handle["trans/data"].chunks == (100,)
+        assert handle["trans/indices"].chunks == (100,)
+        assert handle["trans/data"].compression == "gzip"
+
+
+def test_Hdf5CompressedSparseMatrix_pickle():
+    shape = (100, 200)
+    y = scipy.sparse.random(*shape, 0.1).tocsr()
+    path, group = _mockup(y)
+    write_transposed_sparse_matrix(path, group, shape=shape, by_column=False, transposed_group_name="trans")
+    arr = Hdf5CompressedSparseMatrix(path, group, shape=shape, by_column=False, transposed_group_name="trans", dtype=numpy.float32, rdcc_nbytes=12345)
+
+    ref = y.toarray().astype(numpy.float32)
+    ranges = (range(0, 100), range(50, 60))
+    for copied in [pickle.loads(pickle.dumps(arr)), copy.deepcopy(arr)]:
+        assert isinstance(copied, Hdf5CompressedSparseMatrix)
+        assert copied.dtype == numpy.float32
+        assert copied.transposed_group_name == "trans"
+        assert copied.seed._h5_data.id.get_access_plist().get_chunk_cache()[1] == 12345
+        assert (delayedarray.extract_dense_array(copied) == ref).all()
+        assert (numpy.array(delayedarray.extract_sparse_array(copied, ranges)) == ref[:, 50:60]).all()
+        copied.close()
+
+    # The original is unaffected.
+    assert (delayedarray.extract_dense_array(arr) == ref).all()
+
+
+def test_Hdf5CompressedSparseMatrix_chunks():
+    shape = (100, 80)
+    y = scipy.sparse.random(*shape, 0.1).tocsc()
+    path, group = _mockup(y)
+    arr = Hdf5CompressedSparseMatrix(path, group, shape=shape, by_column=True, chunk_shape=(100, 10))
+    assert delayedarray.chunk_shape(arr) == (100, 10)
+    assert (delayedarray.extract_dense_array(arr) == y.toarray()).all()
+
+    with pytest.raises(ValueError, match="length 2"):
+        Hdf5CompressedSparseMatrix(path, group, shape=shape, by_column=True, chunk_shape=(100,))
+
+    # Tiny chunks in a large dataset trigger a warning.
+    y = scipy.sparse.random(1000, 1000, 0.2).tocsr()
+    _, path = tempfile.mkstemp(suffix=".h5")
+    with h5py.File(path, "w") as handle:
+        handle.create_dataset("foo/data", data=y.data, chunks=(100,))
+        handle.create_dataset("foo/indices", data=y.indices)
+        handle.create_dataset("foo/indptr", data=y.indptr)
+    with pytest.warns(UserWarning, match="per-chunk overhead") as record:
+        Hdf5CompressedSparseMatrix(path, "foo", shape=y.shape, by_column=False)
+    assert len(record) == 1
+    assert record[0].filename == __file__
+
+    # No duplicate warnings for the transposed representation.
+    write_transposed_sparse_matrix(path, "foo", shape=y.shape, by_column=False, transposed_group_name="trans")
+    with pytest.warns(UserWarning, match="per-chunk overhead") as record:
+        Hdf5CompressedSparseMatrixSeed(path, "foo", shape=y.shape, by_column=False, transposed_group_name="trans")
+    assert len(record) == 1
+    assert record[0].filename == __file__
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        Hdf5CompressedSparseMatrix(path, "foo", shape=y.shape, by_column=False, check_chunks=False)
+
 
 def test_Hdf5CompressedSparseMatrix_properties():
     shape = (100, 200)
@@ -118,6 +368,10 @@ def test_Hdf5CompressedSparseMatrix_properties():
     assert arr.data_name == group + "/data"
     assert arr.indices_name == group + "/indices"
     assert arr.indptr_name == group + "/indptr"
+    assert (arr.nnz_counts == numpy.diff(y.indptr)).all()
+    with pytest.raises(ValueError, match="read-only"):
+        arr.nnz_counts[0] = 100
+    assert not pickle.loads(pickle.dumps(arr)).nnz_counts.flags.writeable
 
     rewrap = delayedarray.wrap(arr.seed)
     assert isinstance(rewrap, Hdf5CompressedSparseMatrix)
@@ -1,8 +1,15 @@
 import numpy
 import h5py
+import filebackedarray
 from filebackedarray import Hdf5DenseArray
 import delayedarray
 import tempfile
+import pytest
+import os
+import gc
+import threading
+import pickle
+import copy
 
 __author__ = "jkanche"
 __copyright__ = "jkanche"
@@ -43,6 +50,10 @@ def test_Hdf5DenseArray_native():
     mixed = (ranges[0], slices[1])
     assert (delayedarray.extract_dense_array(arr, (*mixed,)) == ref).all()
 
+    # Check that it works with single-element lists.
+    singles = ([5], [2, 7, 8])
+    assert (delayedarray.extract_dense_array(arr, singles) == y[numpy.ix_(*singles)]).all()
+
 
 def test_Hdf5DenseArray_non_native():
     test_shape = (100, 200)
@@ -85,6 +96,156 @@ def test_Hdf5DenseArray_new_type():
     assert delayedarray.chunk_shape(arr) == chunk_sizes
     assert (delayedarray.extract_dense_array(arr) == y.astype(numpy.int32)).all()
 
+    # Conversions that HDF5 does not perform like NumPy.
+    y = numpy.random.rand(*test_shape) * 1000 - 500
+    y[:, ::3] = 0
+    path, name = _mockup(y, chunk_sizes, 'gzip')
+    for dt in [numpy.bool_, numpy.uint8, numpy.int8]:
+        arr = Hdf5DenseArray(path, name, dtype=numpy.dtype(dt), native_order=True)
+        out = delayedarray.extract_dense_array(arr)
+        assert out.dtype == numpy.dtype(dt)
+        assert (out == y.astype(dt)).all()
+        sub = delayedarray.extract_dense_array(arr, (range(10, 50), range(20, 30)))
+        assert (sub == y[10:50, 20:30].astype(dt)).all()
+
+
+def test_Hdf5DenseArray_chunk_cache():
+    test_shape = (100, 200)
+    y = numpy.random.rand(*test_shape)
+    chunk_sizes = (10, 20)
+    path, name = _mockup(y, chunk_sizes, 'gzip')
+
+    arr = Hdf5DenseArray(path, name, native_order=True)
+    assert arr.seed._h5_dset.id.get_access_plist().get_chunk_cache()[1] >= 4 * 10 * 20 * 8
+
+    # Using a fresh file, as HDF5 ignores the cache settings when the
+    # dataset is already open elsewhere.
+    path, name = _mockup(y, chunk_sizes, 'gzip')
+    arr = Hdf5DenseArray(path, name, native_order=True, rdcc_nbytes=10000, rdcc_nslots=101)
+    assert arr.seed._h5_dset.id.get_access_plist().get_chunk_cache()[:2] == (101, 10000)
+    assert (delayedarray.extract_dense_array(arr) == y).all()
+
+    slices = (slice(3, 90, 3), slice(4, 160, 5))
+    ranges = [range(*s.indices(test_shape[i])) for i, s in enumerate(slices)]
+    assert (delayedarray.extract_dense_array(arr, (*ranges,)) == y[slices]).all()
+
+    # Different settings for a dataset that is already open are ignored.
+    with pytest.warns(UserWarning, match="already open") as record:
+        arr2 = Hdf5DenseArray(path, name, native_order=True, rdcc_nbytes=12345, rdcc_nslots=7)
+    assert record[0].filename == __file__
+    assert arr2.seed._h5_dset.id.get_access_plist().get_chunk_cache()[:2] == (101, 10000)
+    assert (delayedarray.extract_dense_array(arr2) == y).all()
+
+
+def test_Hdf5DenseArray_chunk_shape():
+    y = numpy.random.rand(100, 200)
+    path, name = _mockup(y, (10, 20), 'gzip')
+    arr = Hdf5DenseArray(path, name, native_order=False, chunk_shape=(40, 20))
+    assert delayedarray.chunk_shape(arr) == (40, 20)
+    assert (delayedarray.extract_dense_array(arr) == y.T).all()
+
+
+def test_Hdf5DenseArray_shared_handle():
+    y = numpy.random.rand(50, 20)
+    path, name = _mockup(y, (10, 10), 'gzip')
+    arr1 = Hdf5DenseArray(path, name, native_order=True)
+    arr2 = Hdf5DenseArray(path, name, native_order=False)
+    assert arr1.seed._h5file is arr2.seed._h5file
+
+    handle = arr1.seed._h5file
+    del arr1
+    assert handle.id.valid
+    assert (delayedarray.extract_dense_array(arr2) == y.T).all()
+
+    del handle
+    arr2.close()
+    arr2.close() # second call is a no-op.
+    with pytest.raises(ValueError, match="closed"):
+        delayedarray.extract_dense_array(arr2)
+    with h5py.File(path, "a") as handle: # fails if the file is still open.
+        handle.create_dataset("foo", data=y)
+
+    # Garbage collection also releases the handle.
+    arr3 = Hdf5DenseArray(path, name)
+    del arr3
+    with h5py.File(path, "a") as handle:
+        handle.create_dataset("bar", data=y)
+
+    # Replacing the file does not reuse the handle for the old file.
+    arr4 = Hdf5DenseArray(path, name)
+    os.remove(path)
+    z = numpy.random.rand(30, 40)
+    with h5py.File(path, "w") as handle:
+        handle.create_dataset(name, data=z)
+    arr5 = Hdf5DenseArray(path, name)
+    assert arr5.seed._h5file is not arr4.seed._h5file
+    assert (delayedarray.extract_dense_array(arr5) == z.T).all()
+    assert (delayedarray.extract_dense_array(arr4) == y.T).all()
+    arr4.close()
+    arr5.close()
+
+
+def test_Hdf5DenseArray_release_during_open(monkeypatch):
+    y = numpy.random.rand(20, 10)
+    path1, name = _mockup(y, (10, 10), 'gzip')
+    path2, _ = _mockup(y, (10, 10), 'gzip')
+
+    # A seed in a reference cycle is only finalized by the garbage collector,
+    # which might run while another seed is opening its file.
+    arr1 = Hdf5DenseArray(path1, name)
+    arr1.seed._cycle = arr1.seed
+    del arr1
+
+    def collecting_File(*args, **kwargs):
+        gc.collect()
+        return h5py.File(*args, **kwargs)
+    monkeypatch.setattr(filebackedarray._utils, "File", collecting_File)
+
+    results = []
+    thread = threading.Thread(target=lambda : results.append(Hdf5DenseArray(path2, name)), daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive() # deadlocked otherwise.
+    assert (delayedarray.extract_dense_array(results[0]) == y.T).all()
+    results[0].close()
+    with h5py.File(path1, "a") as handle:
+        handle.create_dataset("foo", data=y)
+
+    # Finalizers that cannot acquire the lock are deferred until the next call.
+    arr1 = Hdf5DenseArray(path1, name)
+    with filebackedarray._utils._open_files_lock:
+        del arr1
+    arr2 = Hdf5DenseArray(path2, name)
+    arr2.close()
+    with h5py.File(path1, "a") as handle:
+        handle.create_dataset("bar", data=y)
+
+    # Explicit closing waits for the lock, so the file is closed on return.
+    arr1 = Hdf5DenseArray(path1, name)
+    lock = filebackedarray._utils._open_files_lock
+    lock.acquire()
+    threading.Timer(0.2, lock.release).start()
+    arr1.close()
+    with h5py.File(path1, "a") as handle:
+        handle.create_dataset("whee2", data=y)
+
+
+def test_Hdf5DenseArray_pickle():
+    y = numpy.random.rand(50, 20)
+    path, name = _mockup(y, (10, 10), 'gzip')
+    arr = Hdf5DenseArray(path, name, dtype=numpy.float32)
+    ref = y.T.astype(numpy.float32)
+
+    for copied in [pickle.loads(pickle.dumps(arr)), copy.deepcopy(arr)]:
+        assert isinstance(copied, Hdf5DenseArray)
+        assert copied.dtype == numpy.float32
+        assert copied.seed._h5file is arr.seed._h5file
+        assert (delayedarray.extract_dense_array(copied) == ref).all()
+        copied.close()
+
+    # The original is unaffected.
+    assert (delayedarray.extract_dense_array(arr) == ref).all()
+
 
 def test_Hdf5DenseArray_properties():
     test_shape = (100, 200)
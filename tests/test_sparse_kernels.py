@@ -0,0 +1,41 @@
+import numpy
+import pytest
+from filebackedarray._sparse_kernels import _subset_run_numpy
+
+pytest.importorskip("numba")
+from filebackedarray._sparse_kernels import _subset_run_numba
+
+__author__ = "LTLA"
+__copyright__ = "LTLA"
+__license__ = "MIT"
+
+
+def _mock_run(counts, secondary_len, keep):
+    ptrs = numpy.concatenate([[0], numpy.cumsum(counts)])
+    indices = numpy.random.randint(0, secondary_len, ptrs[-1]).astype(numpy.int32)
+    data = numpy.random.rand(ptrs[-1])
+    lookup = numpy.full(secondary_len, -1, dtype=numpy.intp)
+    lookup[keep] = numpy.arange(len(keep))
+    return indices, data, ptrs, lookup
+
+
+def _compare(*args):
+    expected = _subset_run_numpy(*args)
+    observed = _subset_run_numba(*args)
+    for e, o in zip(expected, observed):
+        assert (e == o).all()
+
+
+def test_subset_run_numba():
+    for _ in range(20):
+        counts = numpy.random.randint(0, 10, numpy.random.randint(1, 30))
+        keep = numpy.flatnonzero(numpy.random.rand(50) < 0.5)
+        _compare(*_mock_run(counts, 50, keep))
+
+
+def test_subset_run_numba_empty():
+    # Run where every primary element is empty.
+    _compare(*_mock_run(numpy.zeros(5, dtype=int), 50, numpy.arange(10)))
+
+    # Run where every non-zero element is filtered out.
+    _compare(*_mock_run(numpy.array([3, 0, 5]), 50, numpy.array([], dtype=int)))